@@ -1,3 +1,16 @@
+import os
+
 from setuptools import setup
 
-setup()
\ No newline at end of file
+ext_modules = []
+if os.environ.get("XIAN_LINTER_CYTHON"):
+    # Compile the linter ahead of time. The pure-Python module ships alongside
+    # and is used wherever the extension is missing (e.g. Pyodide).
+    from Cython.Build import cythonize
+
+    ext_modules = cythonize(
+        "xian_contracting_linter/linter.py",
+        compiler_directives={"language_level": 3, "boundscheck": False},
+    )
+
+setup(ext_modules=ext_modules)
@@ -1,4 +1,4 @@
-from .main import lint_code
+from .main import lint_code, lint_codes
 
 __version__ = "0.2.14"
-__all__ = ["lint_code"]
+__all__ = ["lint_code", "lint_codes"]
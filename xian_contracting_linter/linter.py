@@ -1,7 +1,14 @@
 import ast
 import builtins
+import pprint
 import sys
 
+try:
+    # Optional native walker; falls back to the pure-Python walk below.
+    from fast_walk import walk_unordered
+except ImportError:
+    walk_unordered = None
+
 # Constants
 RECURSION_LIMIT = 1024
 
@@ -17,6 +24,8 @@ INIT_FUNC_NAME = '__{}'.format(PRIVATE_METHOD_PREFIX)
 VALID_DECORATORS = {EXPORT_DECORATOR_STRING, INIT_DECORATOR_STRING}
 
 ORM_CLASS_NAMES = {'Variable', 'Hash', 'ForeignVariable', 'ForeignHash', 'LogEvent'}
+# ORM classes that define storage in this contract (no contract/name overrides allowed)
+ORM_CONSTRUCTOR_NAMES = frozenset({'Variable', 'Hash', 'LogEvent'})
 
 MAX_HASH_DIMENSIONS = 16
 MAX_KEY_SIZE = 1024
@@ -31,6 +40,9 @@ FILENAME_LEN_MAX = 255
 
 DEFAULT_STAMPS = 1000000
 
+# Linting stops once this many violations have been found (None or < 1 means no cap)
+MAX_VIOLATIONS = 64
+
 # whitelists
 ALLOWED_BUILTINS = {'Exception', 'False', 'None', 'True', 'abs', 'all', 'any', 'ascii', 'bin', 'bool', 'bytearray',
                     'bytes', 'chr', 'dict', 'divmod', 'filter', 'format', 'frozenset', 'hex', 'int', 'isinstance',
@@ -39,6 +51,11 @@ ALLOWED_BUILTINS = {'Exception', 'False', 'None', 'True', 'abs', 'all', 'any', '
 
 ILLEGAL_BUILTINS = set(dir(builtins)) - ALLOWED_BUILTINS
 
+# 'float' may be named (e.g. in annotations) but not called, see no_illegal_builtin_calls
+ILLEGAL_BUILTIN_NAMES = frozenset(ILLEGAL_BUILTINS - {'float'})
+
+BUILTIN_MODULES = frozenset(sys.stdlib_module_names) | frozenset(sys.builtin_module_names)
+
 ALLOWED_AST_TYPES = {ast.Module, ast.Eq, ast.Call, ast.Dict, ast.Attribute, ast.Pow, ast.Index, ast.Not, ast.alias,
                      ast.If, ast.FunctionDef, ast.Global, ast.GtE, ast.LtE, ast.Load, ast.arg, ast.Add, ast.Import,
                      ast.ImportFrom, ast.Name, ast.Num, ast.BinOp, ast.Store, ast.Assert, ast.Assign, ast.AugAssign,
@@ -93,7 +110,58 @@ VIOLATION_TRIGGERS = [
 ]
 
 
-class Linter(ast.NodeVisitor):
+# Triggers whose detail has always been attached with ': ' rather than ' : '
+DETAIL_SEPARATORS = {7: ': ', 9: ': '}
+
+
+def format_violation(violation):
+    """Render the message of a (lineno, trigger index, detail) violation."""
+    _, trigger, detail = violation
+    if detail is None:
+        return VIOLATION_TRIGGERS[trigger]
+    return VIOLATION_TRIGGERS[trigger] + DETAIL_SEPARATORS.get(trigger, ' : ') + str(detail)
+
+
+def walk(root):
+    """Yield every node of the tree in pre-order (source order)."""
+    todo = [root]
+    pop = todo.pop
+    push = todo.append
+    while todo:
+        node = pop()
+        yield node
+        # Same children as ast.iter_child_nodes, without its two nested generators;
+        # they are reversed in place so they pop in source order.
+        start = len(todo)
+        for field in node._fields:
+            value = getattr(node, field, None)
+            if isinstance(value, list):
+                for item in value:
+                    if isinstance(item, ast.AST):
+                        push(item)
+            elif isinstance(value, ast.AST):
+                push(value)
+        if len(todo) - start > 1:
+            todo[start:] = reversed(todo[start:])
+
+
+# All checks are node-local, so visiting order only affects the order violations are reported in.
+walk_nodes = walk_unordered or walk
+
+# node type -> rules fired for it, in registration order
+RULES = {}
+
+
+def register(*node_types):
+    """Register a rule, called as rule(linter, node), for every node of the given types."""
+    def decorator(rule):
+        for node_type in node_types:
+            RULES.setdefault(node_type, []).append(rule)
+        return rule
+    return decorator
+
+
+class Linter:
 
     def __init__(self):
         self._violations = []
@@ -106,226 +174,35 @@ class Linter(ast.NodeVisitor):
         self.return_annotation = set()
         self.arg_types = set()
 
-        self.builtins = list(set(list(sys.stdlib_module_names) + list(sys.builtin_module_names)))
+        self.builtins = BUILTIN_MODULES
 
     def ast_types(self, t, lnum):
         if type(t) not in ALLOWED_AST_TYPES:
-            str = "Line {}".format(lnum) + " : " + VIOLATION_TRIGGERS[0] + " : {}" .format(type(t).__name__)
-            self._violations.append(str)
+            self._violations.append((lnum, 0, type(t).__name__))
             self._is_success = False
 
     def not_system_variable(self, v, lnum):
-        if v.startswith('_') or v.endswith('_'):
-            str = "Line {} : ".format(lnum) + VIOLATION_TRIGGERS[1] + " : {}" .format(v)
-            self._violations.append(str)
+        if v[:1] == '_' or v[-1:] == '_':
+            self._violations.append((lnum, 1, v))
             self._is_success = False
 
     def no_nested_imports(self, node):
         for item in node.body:
             if type(item) in [ast.ImportFrom, ast.Import]:
-                str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[2]
-                self._violations.append(str)
-                self._is_success = False
-
-    def visit_Name(self, node):
-        self.not_system_variable(node.id, node.lineno)
-
-        if node.id == 'rt':# or node.id == 'Hash' or node.id == 'Variable':
-            self._is_success = False
-            str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[13]
-            self._violations.append(str)
-
-        if node.id in ILLEGAL_BUILTINS and node.id != 'float':
-            self._is_success = False
-            str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[13]
-            self._violations.append(str)
-
-        self.generic_visit(node)
-        return node
-
-    def visit_Attribute(self, node):
-        self.not_system_variable(node.attr, node.lineno)
-        if node.attr == 'rt':
-            self._is_success = False
-            str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[13]
-            self._violations.append(str)
-        self.generic_visit(node)
-        return node
-
-    def visit_Import(self, node):
-        for n in node.names:
-            if n.name in self.builtins:
-                self._is_success = False
-                str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[13]
-                self._violations.append(str)
-        return node
-
-    def visit_ImportFrom(self, node):
-        str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[3]
-        self._violations.append(str)
-        self._is_success = False
-
-    # TODO: Why are we even doing any logic instead of just failing on visiting these?
-    def visit_ClassDef(self, node):
-        str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[5]
-        self._violations.append(str)
-        self._is_success = False
-        self.generic_visit(node)
-        return node
-
-    def visit_AsyncFunctionDef(self, node):
-        str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[6]
-        self._violations.append(str)
-
-        self._is_success = False
-        self.generic_visit(node)
-        return node
-
-    def visit_Assign(self, node):
-        # resource_names, func_name = Assert.valid_assign(node, Parser.parser_scope)
-        if isinstance(node.value, ast.Name):
-            if node.value.id == 'Hash' or node.value.id == 'Variable' or node.value.id == 'LogEvent':
+                self._violations.append((node.lineno, 2, None))
                 self._is_success = False
-                str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[13]
-                self._violations.append(str)
-
-        if (isinstance(node.value, ast.Call) and not
-            isinstance(node.value.func, ast.Attribute) and
-            node.value.func.id in ORM_CLASS_NAMES):
-
-            if node.value.func.id in ['Variable', 'Hash', 'LogEvent']:
-                kwargs = [k.arg for k in node.value.keywords]
-                if 'contract' in kwargs or 'name' in kwargs:
-                    self._is_success = False
-                    str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[10]
-                    self._violations.append(str)
-            if ast.Tuple in [type(t) for t in node.targets] or isinstance(node.value, ast.Tuple):
-                self._is_success = False
-                str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[11]
-                self._violations.append(str)
-            try:
-                self.orm_names.add(node.targets[0].id)
-            except AttributeError:
-                pass
-
-        self.generic_visit(node)
-
-        return node
-
-    def visit_AugAssign(self, node):
-        # TODO: Checks here?
-        self.generic_visit(node)
-        return node
-
-    def visit_Call(self, node: ast.Call):
-        # Prevent calling of illegal builtins
-        if isinstance(node.func, ast.Name):
-            if node.func.id in ILLEGAL_BUILTINS:
-                self._is_success = False
-                str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[13]
-                self._violations.append(str)
-
-        self.generic_visit(node)
-        return node
-
-    def generic_visit(self, node):
-        # Prevent calling of illegal builtins
-
-        if type(node) in ILLEGAL_AST_TYPES:
-            self._is_success = False
-            s = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[0]
-            self._violations.append(s)
-
-        return super().generic_visit(node)
-
-    def visit_Num(self, node):
-        # NOTE: Integers are important for indexing and slicing so we cannot replace them.
-        # They also will not suffer from rounding issues.
-        # TODO: are any types we don't allow right now?
-        self.generic_visit(node)
-        return node
-
-    def visit_FunctionDef(self, node):
-        self.no_nested_imports(node)
-
-        # Make sure there are no closures
-        try:
-            for n in node.body:
-                if isinstance(n, ast.FunctionDef):
-                    str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[18]
-                    self._violations.append(str)
-                    self._is_success = False
-        except:
-            pass
-
-        # Only allow 1 decorator per function definition.
-        if len(node.decorator_list) > 1:
-            str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[9] + \
-                  ": Detected: {} MAX limit: 1".format(len(node.decorator_list))
-            self._violations.append(str)
-            self._is_success = False
-        export_decorator = False
-        for d in node.decorator_list:
-            if hasattr(d, "id"):
-                # Only allow decorators from the allowed set.
-                if d.id not in VALID_DECORATORS:
-                    str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[7] + \
-                        ": valid list: {}".format(VALID_DECORATORS)
-                    self._violations.append(str)
-                    self._is_success = False
-
-                if d.id == EXPORT_DECORATOR_STRING:
-                    self._is_one_export = True
-                    export_decorator = True
-
-                if d.id == INIT_DECORATOR_STRING:
-                    if self._constructor_visited:
-                        str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[8]
-                        self._violations.append(str)
-                        self._is_success = False
-                    self._constructor_visited = True
-
-        # Add argument names to set to make sure that no ORM variable names are being reused in function def args
-        arguments = node.args
-        for a in arguments.args:
-            self.visited_args.add((a.arg, node.lineno))
-            if export_decorator:
-                if a.annotation is not None:
-                    try:
-                        self.arg_types.add((a.annotation.id, node.lineno))
-                    except AttributeError:
-                        arg = a.annotation.value.id + '.' + a.annotation.attr
-                        self.arg_types.add((arg, node.lineno))
-                else:
-                    self.arg_types.add((None, node.lineno))
-
-        if export_decorator:
-            if node.returns is not None:
-                try:
-                    self.arg_types.add((a.annotation.id, node.lineno))
-                except AttributeError:
-                    arg = a.annotation.value.id + '.' + a.annotation.attr
-                    self.arg_types.add((arg, node.lineno))
-            else:
-                self.return_annotation.add((None, node.lineno))
-
-        self.generic_visit(node)
-        return node
 
     def annotation_types(self, t, lnum):
         if t is None:
-            str = "Line {}".format(lnum) + " : " + VIOLATION_TRIGGERS[16]
-            self._violations.append(str)
+            self._violations.append((lnum, 16, None))
             self._is_success = False
         elif t not in ALLOWED_ANNOTATION_TYPES:
-            str = "Line {}".format(lnum) + " : " + VIOLATION_TRIGGERS[15] + " : {}" .format(t)
-            self._violations.append(str)
+            self._violations.append((lnum, 15, t))
             self._is_success = False
 
     def check_return_types(self, t, lnum):
         if t is not None:
-            str = "Line {}".format(lnum) + " : " + VIOLATION_TRIGGERS[17] + " : {}" .format(t)
-            self._violations.append(str)
+            self._violations.append((lnum, 17, t))
             self._is_success = False
 
     def _reset(self):
@@ -342,13 +219,12 @@ class Linter(ast.NodeVisitor):
     def _final_checks(self):
         for name, lineno in self.visited_args:
             if name in self.orm_names:
-                str = "Line {}: ".format(lineno) + VIOLATION_TRIGGERS[14]
-                self._violations.append(str)
+                self._violations.append((lineno, 14, None))
                 self._is_success = False
 
         if not self._is_one_export:
-            str = "Line {}: ".format(lineno) + VIOLATION_TRIGGERS[12]
-            self._violations.append(str)
+            # Applies to the whole contract, so it carries no line.
+            self._violations.append((0, 12, None))
             self._is_success = False
 
         for t, lineno in self.arg_types:
@@ -357,32 +233,206 @@ class Linter(ast.NodeVisitor):
         for t, lineno in self.return_annotation:
             self.check_return_types(t,lineno)
 
-    def _collect_function_defs(self, root):
-        for node in ast.walk(root):
-            if isinstance(node, ast.FunctionDef):
-                self._functions.append(node.name)
-            elif isinstance(node, ast.Import) or isinstance(node, ast.ImportFrom):
-                for n in node.names:
-                    if n.asname:
-                        self._functions.append(n.asname)
-                    else:
-                        self._functions.append(n.name.split('.')[-1])
-
-    def check(self, ast_tree):
+    def _walk(self, root, max_violations):
+        # Fire the rules registered for each node type. Returns False if a node with rules was
+        # left unchecked because the cap had been reached.
+        violations = self._violations
+        get_rules = RULES.get
+        for node in walk_nodes(root):
+            rules = get_rules(type(node))
+            # Most node types (operators, contexts, constants...) have no rules at all.
+            if rules is None:
+                continue
+            if len(violations) >= max_violations:
+                return False
+            for rule in rules:
+                rule(self, node)
+        return True
+
+    def check(self, ast_tree, max_violations=MAX_VIOLATIONS):
         self._reset()
-        # pass 1 - collect function def and imports
-        self._collect_function_defs(ast_tree)
-        self.visit(ast_tree)
-        self._final_checks()
+        if max_violations is None or max_violations < 1:
+            max_violations = sys.maxsize
+        # single pass - collects function defs and imports while checking
+        if self._walk(ast_tree, max_violations):
+            self._final_checks()
+        # else: the final checks need the whole tree, so they are skipped on a partial walk.
+        del self._violations[max_violations:]
         if self._is_success is False:
             #print(self.dump_violations())
             return self._violations
         else:
             return None
 
+    def _render(self):
+        return ["Line {}: {}".format(v[0], format_violation(v)) for v in self._violations]
+
     def dump_violations(self):
-        import pprint
-        pp = pprint.PrettyPrinter(indent=4)
-        pp.pprint(self._violations)
+        pprint.pprint(self._render(), indent=4)
+
+
+@register(ast.FunctionDef)
+def collect_function(linter, node):
+    linter._functions.append(node.name)
+
+
+@register(ast.Import, ast.ImportFrom)
+def collect_imports(linter, node):
+    for n in node.names:
+        if n.asname:
+            linter._functions.append(n.asname)
+        else:
+            linter._functions.append(n.name.split('.')[-1])
+
+
+@register(ast.Name)
+def no_system_variable_name(linter, node):
+    linter.not_system_variable(node.id, node.lineno)
+
+
+@register(ast.Name)
+def no_rt_name(linter, node):
+    if node.id == 'rt':# or node.id == 'Hash' or node.id == 'Variable':
+        linter._is_success = False
+        linter._violations.append((node.lineno, 13, None))
+
+
+@register(ast.Name)
+def no_illegal_builtin_name(linter, node):
+    if node.id in ILLEGAL_BUILTIN_NAMES:
+        linter._is_success = False
+        linter._violations.append((node.lineno, 13, None))
+
+
+@register(ast.Attribute)
+def no_system_variable_attribute(linter, node):
+    linter.not_system_variable(node.attr, node.lineno)
+
+
+@register(ast.Attribute)
+def no_rt_attribute(linter, node):
+    if node.attr == 'rt':
+        linter._is_success = False
+        linter._violations.append((node.lineno, 13, None))
+
+
+@register(ast.Import)
+def no_builtin_module_imports(linter, node):
+    for n in node.names:
+        if n.name in linter.builtins:
+            linter._is_success = False
+            linter._violations.append((node.lineno, 13, None))
+
+
+@register(ast.ImportFrom)
+def no_import_from(linter, node):
+    linter._violations.append((node.lineno, 3, None))
+    linter._is_success = False
+
+
+# TODO: Why are we even doing any logic instead of just failing on visiting these?
+@register(ast.ClassDef)
+def no_classes(linter, node):
+    linter._violations.append((node.lineno, 5, None))
+    linter._is_success = False
+
+
+@register(ast.AsyncFunctionDef)
+def no_async_functions(linter, node):
+    linter._violations.append((node.lineno, 6, None))
+
+    linter._is_success = False
+
+
+@register(ast.Assign)
+def orm_assignment(linter, node):
+    # resource_names, func_name = Assert.valid_assign(node, Parser.parser_scope)
+    v = node.value
+    if type(v) is ast.Name and v.id in ORM_CONSTRUCTOR_NAMES:
+        linter._is_success = False
+        linter._violations.append((node.lineno, 13, None))
+
+    if type(v) is ast.Call and type(v.func) is ast.Name and v.func.id in ORM_CLASS_NAMES:
+        if v.func.id in ORM_CONSTRUCTOR_NAMES:
+            if any(k.arg == 'contract' or k.arg == 'name' for k in v.keywords):
+                linter._is_success = False
+                linter._violations.append((node.lineno, 10, None))
+        if any(type(t) is ast.Tuple for t in node.targets):
+            linter._is_success = False
+            linter._violations.append((node.lineno, 11, None))
+        try:
+            linter.orm_names.add(node.targets[0].id)
+        except AttributeError:
+            pass
+
+
+@register(ast.Call)
+def no_illegal_builtin_calls(linter, node):
+    # Prevent calling of illegal builtins
+    if isinstance(node.func, ast.Name):
+        if node.func.id in ILLEGAL_BUILTINS:
+            linter._is_success = False
+            linter._violations.append((node.lineno, 13, None))
+
+
+def annotation_name(annotation):
+    # Anything that isn't a plain name (e.g. datetime.datetime, None, list[str]) is named by its
+    # source text, so unsupported annotations are reported as S16 rather than raising.
+    if type(annotation) is ast.Name:
+        return annotation.id
+    return ast.unparse(annotation)
+
+
+@register(ast.FunctionDef)
+def function_definition(linter, node):
+    linter.no_nested_imports(node)
+
+    # Make sure there are no closures
+    for n in node.body:
+        if isinstance(n, ast.FunctionDef):
+            linter._violations.append((node.lineno, 18, None))
+            linter._is_success = False
+
+    # Only allow 1 decorator per function definition.
+    num_decorators = len(node.decorator_list)
+    if num_decorators > 1:
+        linter._violations.append((node.lineno, 9, "Detected: {} MAX limit: 1".format(num_decorators)))
+        linter._is_success = False
+    export_decorator = False
+    for d in node.decorator_list:
+        d_id = getattr(d, 'id', None)
+        if d_id is None:
+            continue
+
+        # Only allow decorators from the allowed set.
+        if d_id not in VALID_DECORATORS:
+            linter._violations.append((node.lineno, 7, "valid list: {}".format(VALID_DECORATORS)))
+            linter._is_success = False
+        elif d_id == EXPORT_DECORATOR_STRING:
+            linter._is_one_export = True
+            export_decorator = True
+        else:  # INIT_DECORATOR_STRING
+            if linter._constructor_visited:
+                linter._violations.append((node.lineno, 8, None))
+                linter._is_success = False
+            linter._constructor_visited = True
+
+    # Add argument names to set to make sure that no ORM variable names are being reused in function def args
+    for a in node.args.args:
+        linter.visited_args.add((a.arg, node.lineno))
+        if export_decorator:
+            if a.annotation is not None:
+                linter.arg_types.add((annotation_name(a.annotation), node.lineno))
+            else:
+                linter.arg_types.add((None, node.lineno))
+
+    # Return annotations are not restricted: only arguments are checked against ALLOWED_ANNOTATION_TYPES,
+    # and nothing is recorded for check_return_types (S18), matching the contracting linter.
+
 
-print("linter loaded!")
+# Registered last so it fires after the node's specific rules. ImportFrom already reports S4
+# and was never flagged as an illegal type on top of it.
+@register(*(ILLEGAL_AST_TYPES - {ast.ImportFrom}))
+def no_illegal_node_types(linter, node):
+    linter._is_success = False
+    linter._violations.append((node.lineno, 0, None))
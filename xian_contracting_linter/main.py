@@ -1,15 +1,17 @@
-import asyncio
 import ast
+import asyncio
+import multiprocessing
+import os
 import re
-from io import StringIO
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from functools import lru_cache
 
-from pyflakes.api import check
-from pyflakes.reporter import Reporter
+from pyflakes.checker import Checker
 
-from xian_contracting_linter.linter import Linter
+from xian_contracting_linter.linter import MAX_VIOLATIONS, Linter, format_violation
 
-__all__ = ["lint_code"]
+__all__ = ["lint_code", "lint_codes"]
 
 
 class Settings:
@@ -53,92 +55,60 @@ class LintingException(Exception):
 
 
 # Compile regex patterns once
-PYFLAKES_PATTERN = re.compile(r"<string>:(\d+):(\d+):\s*(.+)")
-CONTRACTING_PATTERN = re.compile(r"Line (\d+):\s*(.+)")
+LOCATION_PATTERN = re.compile(r"\s*\(<unknown>,\s*line\s*\d+\)$")
 
 
 def standardize_error_message(message):
     """Standardize error message by removing extra location information."""
-    location_pattern = r"\s*\(<unknown>,\s*line\s*\d+\)$"
-    message = re.sub(location_pattern, "", message)
-    return message
-
-
-def is_duplicate_error(error1, error2):
-    """Check if two errors are duplicates by comparing standardized messages and positions."""
-    # msg1 = standardize_error_message(error1["message"])
-    # msg2 = standardize_error_message(error2["message"])
-
-    if error1["message"] != error2["message"]:
-        return False
-
-    # if bool(error1.position) != bool(error2.position):
-    if bool(error1["line"]) != bool(error2["line"]):
-        return False
-
-    # if error1.position and error2.position:
-    if error1["line"] and error2["line"]:
-        return error1["line"] == error2["line"] and error1["col"] == error2["col"]
-
-    return True
+    return LOCATION_PATTERN.sub("", message)
 
 
 def deduplicate_errors(errors):
     """Remove duplicate errors while preserving order."""
+    seen = set()
     unique_errors = []
     for error in errors:
         error["message"] = standardize_error_message(error["message"])
-        if not any(is_duplicate_error(error, existing) for existing in unique_errors):
+        # Errors without a (truthy) line are duplicates whenever their messages match.
+        if error.get("line"):
+            key = (error["message"], error["line"], error.get("col"))
+        else:
+            key = (error["message"],)
+        if key not in seen:
+            seen.add(key)
             unique_errors.append(error)
     return unique_errors
 
 
-def parse_pyflakes_line(line, whitelist_patterns):
-    """Parse a Pyflakes error line into standardized format"""
-    match = PYFLAKES_PATTERN.match(line)
-    if not match:
-        return None
-
-    line_num, col, message = match.groups()
+def parse_pyflakes_message(message, whitelist_re):
+    """Convert a Pyflakes message into standardized format"""
+    text = message.message % message.message_args
 
-    if any(pattern in message for pattern in whitelist_patterns):
+    if whitelist_re.search(text):
         return None
 
-    return {"message": message, "line": int(line_num) - 1, "col": int(col) - 1}
+    return {"message": text, "line": message.lineno - 1, "col": message.col}
 
 
 def parse_contracting_line(violation):
-    """Parse a Contracting linter error into standardized format"""
-    match = CONTRACTING_PATTERN.match(violation)
-    if match:
-        line_num = int(match.group(1))
-        message = match.group(2)
-        if line_num == 0:
-            return {"message": message}
+    """Convert a Contracting linter violation tuple into standardized format"""
+    line_num = violation[0]
+    message = format_violation(violation)
+    if line_num == 0:
+        return {"message": message}
 
-        return {"message": message, "line": line_num - 1, "col": 0}
-    return {"message": violation}
+    return {"message": message, "line": line_num - 1, "col": 0}
 
 
-async def run_pyflakes(code, whitelist_patterns):
+def run_pyflakes(tree, whitelist_re):
     """Runs Pyflakes and returns standardized errors"""
     try:
-        loop = asyncio.get_event_loop()
-        stdout = StringIO()
-        stderr = StringIO()
-        reporter = Reporter(stdout, stderr)
+        checker = Checker(tree, "<string>")
+        checker.messages.sort(key=lambda m: m.lineno)
 
-        await loop.run_in_executor(None, check, code, "<string>", reporter)
-
-        combined_output = stdout.getvalue() + stderr.getvalue()
         errors = []
-
-        for line in combined_output.splitlines():
-            line = line.strip()
-            if not line:
-                continue
-
-            error = parse_pyflakes_line(line, whitelist_patterns)
+        for message in checker.messages:
+            error = parse_pyflakes_message(message, whitelist_re)
             if error:
                 errors.append(error)
 
@@ -147,27 +117,35 @@ async def run_pyflakes(code, whitelist_patterns):
         raise LintingException(str(e)) from e
 
 
-async def run_contracting_linter(code):
+def run_contracting_linter(tree, max_violations=MAX_VIOLATIONS):
     """Runs Contracting linter and returns standardized errors"""
     try:
-        loop = asyncio.get_event_loop()
-        tree = await loop.run_in_executor(None, ast.parse, code)
         linter = Linter()
-        violations = await loop.run_in_executor(None, linter.check, tree)
+        violations = linter.check(tree, max_violations=max_violations)
 
         if not violations:
             return []
 
-        return [parse_contracting_line(v.strip()) for v in violations if v.strip()]
+        return [parse_contracting_line(v) for v in violations]
+    except Exception as e:
+        raise LintingException(str(e)) from e
+
+
+def parse_code(code):
+    """Parse the source once for all linters, returning (tree, syntax errors)"""
+    try:
+        return ast.parse(code), []
+    except SyntaxError as e:
+        if e.lineno is None:
+            raise LintingException(str(e)) from e
+        return None, [
+            {
+                "message": str(e),
+                "line": e.lineno - 1,
+                "col": e.offset - 1 if e.offset else 0,
+            }
+        ]
     except Exception as e:
-        if isinstance(e, SyntaxError) and e.lineno is not None:
-            return [
-                {
-                    "message": str(e),
-                    "line": e.lineno - 1,
-                    "col": e.offset - 1 if e.offset else 0,
-                }
-            ]
         raise LintingException(str(e)) from e
 
 
@@ -177,18 +155,61 @@ def get_whitelist_patterns():
     return settings.DEFAULT_WHITELIST_PATTERNS
 
 
-async def lint_code(code):
-    """Run all linters in parallel"""
-    try:
-        whitelist_patterns = get_whitelist_patterns()
+@lru_cache(maxsize=settings.CACHE_SIZE)
+def get_whitelist_re():
+    """Compile the whitelist patterns into a single regex alternation"""
+    patterns = sorted(get_whitelist_patterns())
+    # An empty alternation would match everything, so use a never-matching pattern instead
+    return re.compile("|".join(map(re.escape, patterns)) or "(?!)")
+
+
+def run_linters(code):
+    """Run all linters; both are CPU-bound, so they run in sequence"""
+    whitelist_re = get_whitelist_re()
+
+    tree, syntax_errors = parse_code(code)
+    if syntax_errors:
+        return deduplicate_errors(syntax_errors)
+
+    all_errors = run_pyflakes(tree, whitelist_re) + run_contracting_linter(tree)
+
+    return deduplicate_errors(all_errors)
+
+
+@lru_cache(maxsize=settings.CACHE_SIZE)
+def _lint_sync(code):
+    """Cached run_linters; errors are stored frozen so callers can't mutate the cache"""
+    return tuple(tuple(error.items()) for error in run_linters(code))
+
 
-        pyflakes_task = run_pyflakes(code, whitelist_patterns)
-        contracting_task = run_contracting_linter(code)
+def lint_one(code):
+    """Lint a single source, reusing the result for unchanged code"""
+    try:
+        if len(code) > settings.MAX_CODE_SIZE:
+            # Don't keep oversized sources alive in the cache
+            return run_linters(code)
 
-        results = await asyncio.gather(pyflakes_task, contracting_task)
-        all_errors = results[0] + results[1]
-        
-        return deduplicate_errors(all_errors)
+        return [dict(error) for error in _lint_sync(code)]
     except LintingException as e:
         error_msg = str(e)
         return [{"message": error_msg}]
+
+
+@lru_cache(maxsize=1)
+def get_executor():
+    """Worker pool for lint_codes, created on first use"""
+    # Forked workers start with pyflakes and the linter already imported
+    mp_context = multiprocessing.get_context("fork") if sys.platform == "linux" else None
+    return ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=mp_context)
+
+
+async def lint_code(code):
+    """Run all linters on a single source"""
+    return lint_one(code)
+
+
+async def lint_codes(codes):
+    """Lint many sources in parallel worker processes (not available under Pyodide)"""
+    loop = asyncio.get_running_loop()
+    executor = get_executor()
+    return await asyncio.gather(*(loop.run_in_executor(executor, lint_one, code) for code in codes))